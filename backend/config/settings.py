@@ -1,12 +1,24 @@
+import os
 from pydantic_settings import BaseSettings
 from typing import Optional
 
 class Settings(BaseSettings):
     app_name: str = "AI Audiobook Image Generator"
-    database_url: str = "sqlite:///./audiobooks.db"
+    database_url: str = "sqlite+aiosqlite:///./audiobooks.db"
+    db_pool_size: int = 20
+    db_max_overflow: int = 10
+    db_pool_timeout: int = 30  # seconds
+    db_pool_recycle: int = 3600  # seconds
     upload_dir: str = "./uploads"
     max_file_size: int = 500 * 1024 * 1024  # 500MB
     allowed_audio_types: list = ["audio/mpeg","audio/mp3", "audio/mp4", "audio/x-m4a"]
+    workers: int = (os.cpu_count() or 1) * 2 + 1
+    # Base URL Replicate can reach this API on. When set, predictions report
+    # completion through a webhook instead of being polled
+    public_base_url: Optional[str] = None
+    replicate_webhook_timeout: int = 120  # seconds before falling back to polling
+    # Pending images older than this are left over from a worker that died mid-pipeline
+    image_stale_after: int = 900  # seconds
     
     class Config:
         env_file = ".env"
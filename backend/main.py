@@ -1,11 +1,32 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from fastapi.staticfiles import StaticFiles
 from config.settings import settings
-from routers import audiobooks
+from models.database import engine, init_db
+from routers import audiobooks, internal
+from services.audio_service import audio_service
+from services.generation_service import generation_service
+from services.image_service import image_service
+from services.transcription_service import transcription_service
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await init_db()
+    await generation_service.fail_stale()
+    yield
+    await image_service.aclose()
+    await transcription_service.aclose()
+    audio_service.shutdown()
 
 # Create FastAPI app
-app = FastAPI(title=settings.app_name, version="1.0.0")
+app = FastAPI(
+    title=settings.app_name,
+    version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,
+)
 
 # Add CORS middleware
 app.add_middleware(
@@ -18,6 +39,7 @@ app.add_middleware(
 
 # Include routers
 app.include_router(audiobooks.router)
+app.include_router(internal.router)
 
 # Mount static files for serving uploads
 app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
@@ -30,6 +52,22 @@ async def root():
 async def health_check():
     return {"status": "healthy"}
 
+async def _create_schema():
+    await init_db()
+    await engine.dispose()
+
 if __name__ == "__main__":
+    import asyncio
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    # Create the schema before the workers start, so their lifespans only
+    # see existing tables instead of racing each other to CREATE TABLE
+    asyncio.run(_create_schema())
+    # Multiple workers need the app as an import string
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8000,
+        loop="uvloop",
+        http="httptools",
+        workers=settings.workers,
+    )
\ No newline at end of file
@@ -1,12 +1,40 @@
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Index, event
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.orm import relationship
+from sqlalchemy.pool import AsyncAdaptedQueuePool, StaticPool
 from sqlalchemy.sql import func
 from config.settings import settings
 
 # Database setup
-engine = create_engine(settings.database_url, connect_args={"check_same_thread": False})
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+def _engine_options(url: str) -> dict:
+    """Pool options for the engine, an in-memory SQLite database has to share one connection"""
+    if url.startswith("sqlite") and ":memory:" in url:
+        return {"poolclass": StaticPool}
+
+    # aiosqlite defaults to NullPool for file databases, name the pool so the sizing applies
+    return {
+        "poolclass": AsyncAdaptedQueuePool,
+        "pool_size": settings.db_pool_size,
+        "max_overflow": settings.db_max_overflow,
+        "pool_timeout": settings.db_pool_timeout,
+        "pool_recycle": settings.db_pool_recycle,
+        "pool_pre_ping": True,
+    }
+
+engine = create_async_engine(settings.database_url, **_engine_options(settings.database_url))
+
+if settings.database_url.startswith("sqlite"):
+    @event.listens_for(engine.sync_engine, "connect")
+    def _sqlite_pragmas(dbapi_connection, connection_record):
+        # WAL lets readers run alongside a writer, NORMAL sync is safe under WAL
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.execute("PRAGMA mmap_size=268435456")  # 256MB
+        cursor.close()
+SessionLocal = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
 Base = declarative_base()
 
 class Audiobook(Base):
@@ -20,31 +48,50 @@ class Audiobook(Base):
     upload_timestamp = Column(DateTime(timezone=True), server_default=func.now())
     file_path = Column(String(500), nullable=False)
     
-    # Relationship to generated images
-    images = relationship("GeneratedImage", back_populates="audiobook", cascade="all, delete-orphan")
+    # Relationship to generated images, load it explicitly (selectinload) where it's needed
+    images = relationship(
+        "GeneratedImage",
+        back_populates="audiobook",
+        cascade="all, delete-orphan",
+        lazy="raise_on_sql"
+    )
+
+# GeneratedImage.status values
+IMAGE_STATUS_PENDING = "pending"
+IMAGE_STATUS_COMPLETED = "completed"
+IMAGE_STATUS_FAILED = "failed"
 
 class GeneratedImage(Base):
     __tablename__ = "generated_images"
+    __table_args__ = (
+        # serve_image looks images up by audiobook and filename
+        Index("ix_generated_images_audiobook_filename", "audiobook_id", "image_filename"),
+        Index("ix_generated_images_audiobook_timestamp", "audiobook_id", "timestamp_seconds"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     audiobook_id = Column(Integer, ForeignKey("audiobooks.id"), nullable=False)
     timestamp_seconds = Column(Integer, nullable=False)
-    transcription = Column(Text, nullable=False)
-    image_prompt = Column(Text, nullable=False)
-    image_filename = Column(String(255), nullable=False)
-    image_path = Column(String(500), nullable=False)
+    # Generation runs in the background, these are filled in once it completes
+    status = Column(String(20), nullable=False, default=IMAGE_STATUS_PENDING)
+    error = Column(Text, nullable=True)
+    # Replicate prediction, set while waiting on its webhook
+    prediction_id = Column(String(64), nullable=True, index=True)
+    transcription = Column(Text, nullable=True)
+    image_prompt = Column(Text, nullable=True)
+    image_filename = Column(String(255), nullable=True)
+    image_path = Column(String(500), nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
     # Relationship to audiobook
-    audiobook = relationship("Audiobook", back_populates="images")
+    audiobook = relationship("Audiobook", back_populates="images", lazy="raise_on_sql")
 
-# Create tables
-Base.metadata.create_all(bind=engine)
+# Create tables (called from the app lifespan, the async engine needs a running loop)
+async def init_db():
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
 
 # Dependency to get database session
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
\ No newline at end of file
@@ -21,10 +21,12 @@ class GeneratedImageResponse(BaseModel):
     id: int
     audiobook_id: int
     timestamp_seconds: int
-    transcription: str
-    image_prompt: str
-    image_filename: str
-    image_path: str
+    status: str
+    error: Optional[str]
+    transcription: Optional[str]
+    image_prompt: Optional[str]
+    image_filename: Optional[str]
+    image_path: Optional[str]
     created_at: datetime
     
     class Config:
@@ -35,4 +37,12 @@ class AudiobookWithImages(AudiobookResponse):
 
 class UploadResponse(BaseModel):
     message: str
-    audiobook: AudiobookResponse
\ No newline at end of file
+    audiobook: AudiobookResponse
+
+class GenerateImageResponse(BaseModel):
+    message: str
+    image: GeneratedImageResponse
+
+class ReplicateWebhook(BaseModel):
+    # Only the id is used, the prediction itself is re-fetched from the API
+    id: str
\ No newline at end of file
@@ -1,24 +1,74 @@
-from fastapi import APIRouter, Depends, UploadFile, File, Form, HTTPException, Request
-from fastapi.responses import FileResponse, StreamingResponse
-from sqlalchemy.orm import Session
-from typing import List
+from fastapi import APIRouter, BackgroundTasks, Depends, UploadFile, File, Form, HTTPException, Query, Request
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from email.utils import formatdate, parsedate_to_datetime
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from typing import List, Optional, Tuple
 import os
-import re
 
-from models.database import get_db, Audiobook, GeneratedImage
-from models.schemas import AudiobookResponse, AudiobookWithImages, UploadResponse
+from models.database import get_db, Audiobook, GeneratedImage, IMAGE_STATUS_PENDING
+from models.schemas import (
+    AudiobookResponse,
+    AudiobookWithImages,
+    GeneratedImageResponse,
+    GenerateImageResponse,
+    UploadResponse,
+)
 from services.storage_service import storage_service
-from services.audio_service import AudioService
-from services.transcription_service import TranscriptionService
-from services.image_service import ImageService
+from services.audio_service import audio_service
+from services.generation_service import generation_service
 
 router = APIRouter(prefix="/audiobooks", tags=["audiobooks"])
 
+# Read size for ranged audio responses, each chunk is a threadpool hop
+AUDIO_CHUNK_SIZE = 1024 * 1024  # 1MB
+
+def _cache_headers(stat: os.stat_result, immutable: bool = False) -> dict:
+    """Validator and caching headers for a served file.
+
+    Only URLs that contain the file's unique filename may be cached as
+    immutable. URLs keyed by database id must revalidate, as SQLite reuses
+    the id of a deleted newest row for the next upload.
+    """
+    return {
+        "ETag": f'W/"{stat.st_size:x}-{stat.st_mtime_ns:x}"',
+        "Last-Modified": formatdate(stat.st_mtime, usegmt=True),
+        "Cache-Control": "public, max-age=31536000, immutable" if immutable else "no-cache",
+    }
+
+def _parse_range(range_header: str) -> Optional[Tuple[int, Optional[int]]]:
+    """Parse the first range of a "bytes=start-[end]" header without the regex engine"""
+    if not range_header.startswith("bytes="):
+        return None
+
+    start, _, end = range_header[6:].split(",", 1)[0].strip().partition("-")
+    if not start.isdecimal() or (end and not end.isdecimal()):
+        return None
+
+    return int(start), int(end) if end else None
+
+def _is_not_modified(request: Request, cache_headers: dict, stat: os.stat_result) -> bool:
+    """Check the conditional request headers against the file's validators"""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        return "*" in tags or cache_headers["ETag"] in tags
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(stat.st_mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+
+    return False
+
 @router.post("/upload", response_model=UploadResponse)
 async def upload_audiobook(
     file: UploadFile = File(...),
     style_prompt: str = Form(...),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Upload an audiobook file with style prompt"""
     
@@ -27,17 +77,21 @@ async def upload_audiobook(
     print("File:", file.filename,file.content_type);
     filename, file_path = await storage_service.save_audio_file(file)
     
+    # Probe once at upload so list/detail endpoints never have to
+    duration = await audio_service.get_audio_duration(file_path)
+    
     # Create database record
     audiobook = Audiobook(
         filename=filename,
         original_name=file.filename,
         style_prompt=style_prompt,
+        duration_seconds=int(duration) if duration is not None else None,
         file_path=file_path
     )
     
     db.add(audiobook)
-    db.commit()
-    db.refresh(audiobook)
+    await db.commit()
+    await db.refresh(audiobook)
     
     return UploadResponse(
         message="Audiobook uploaded successfully",
@@ -45,51 +99,93 @@ async def upload_audiobook(
     )
 
 @router.get("/{audiobook_id}", response_model=AudiobookWithImages)
-async def get_audiobook(audiobook_id: int, db: Session = Depends(get_db)):
+async def get_audiobook(audiobook_id: int, db: AsyncSession = Depends(get_db)):
     """Get audiobook details with generated images"""
     
-    audiobook = db.query(Audiobook).filter(Audiobook.id == audiobook_id).first()
+    result = await db.execute(
+        select(Audiobook)
+        .options(selectinload(Audiobook.images))
+        .where(Audiobook.id == audiobook_id)
+    )
+    audiobook = result.scalar_one_or_none()
     if not audiobook:
         raise HTTPException(status_code=404, detail="Audiobook not found")
     
     return AudiobookWithImages.model_validate(audiobook)
 
 @router.get("/", response_model=List[AudiobookResponse])
-async def list_audiobooks(db: Session = Depends(get_db)):
-    """List all audiobooks"""
+async def list_audiobooks(
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[int] = Query(None, description="Return audiobooks with an id below this one"),
+    db: AsyncSession = Depends(get_db)
+):
+    """List audiobooks, newest first, one page at a time"""
+    
+    # Select plain columns so no ORM objects are built, response_model validates the rows once
+    stmt = select(
+        Audiobook.id,
+        Audiobook.filename,
+        Audiobook.original_name,
+        Audiobook.style_prompt,
+        Audiobook.duration_seconds,
+        Audiobook.upload_timestamp,
+        Audiobook.file_path
+    ).order_by(Audiobook.id.desc()).limit(limit)
     
-    audiobooks = db.query(Audiobook).all()
-    return [AudiobookResponse.model_validate(book) for book in audiobooks]
+    # Keyset pagination, pass the last id of the previous page as the cursor
+    if cursor is not None:
+        stmt = stmt.where(Audiobook.id < cursor)
+    
+    result = await db.execute(stmt)
+    return result.mappings().all()
 
 @router.delete("/{audiobook_id}")
-async def delete_audiobook(audiobook_id: int, db: Session = Depends(get_db)):
+async def delete_audiobook(
+    audiobook_id: int,
+    background_tasks: BackgroundTasks,
+    db: AsyncSession = Depends(get_db)
+):
     """Delete an audiobook and its files"""
     
-    audiobook = db.query(Audiobook).filter(Audiobook.id == audiobook_id).first()
+    # The delete cascade needs the images loaded
+    result = await db.execute(
+        select(Audiobook)
+        .options(selectinload(Audiobook.images))
+        .where(Audiobook.id == audiobook_id)
+    )
+    audiobook = result.scalar_one_or_none()
     if not audiobook:
         raise HTTPException(status_code=404, detail="Audiobook not found")
     
-    # Delete file
-    storage_service.delete_file(audiobook.file_path)
+    # Collect paths before the rows go away, the cascade doesn't touch files
+    file_paths = [audiobook.file_path]
+    file_paths.extend(image.image_path for image in audiobook.images if image.image_path)
     
     # Delete from database (cascade will handle images)
-    db.delete(audiobook)
-    db.commit()
+    await db.delete(audiobook)
+    await db.commit()
+    
+    # Remove files only once the commit succeeded. Sync tasks run in the threadpool
+    for file_path in file_paths:
+        background_tasks.add_task(storage_service.delete_file, file_path)
     
     return {"message": "Audiobook deleted successfully"}
 
 @router.get("/{audiobook_id}/audio")
-async def serve_audio(audiobook_id: int, request: Request, db: Session = Depends(get_db)):
+async def serve_audio(audiobook_id: int, request: Request, db: AsyncSession = Depends(get_db)):
     """Serve audio file for playback with range request support"""
 
-    audiobook = db.query(Audiobook).filter(Audiobook.id == audiobook_id).first()
+    result = await db.execute(select(Audiobook).where(Audiobook.id == audiobook_id))
+    audiobook = result.scalar_one_or_none()
     if not audiobook:
         raise HTTPException(status_code=404, detail="Audiobook not found")
 
-    if not os.path.exists(audiobook.file_path):
+    try:
+        stat = os.stat(audiobook.file_path)
+    except FileNotFoundError:
         raise HTTPException(status_code=404, detail="Audio file not found")
 
-    file_size = os.path.getsize(audiobook.file_path)
+    file_size = stat.st_size
     range_header = request.headers.get("range")
 
     headers = {
@@ -98,15 +194,21 @@ async def serve_audio(audiobook_id: int, request: Request, db: Session = Depends
         "Access-Control-Allow-Origin": "*",
         "Access-Control-Allow-Methods": "GET",
         "Access-Control-Allow-Headers": "*",
-        "Access-Control-Expose-Headers": "Accept-Ranges, Content-Length, Content-Range",
+        "Access-Control-Expose-Headers": "Accept-Ranges, Content-Length, Content-Range, ETag",
     }
+    cache_headers = _cache_headers(stat)
+    headers.update(cache_headers)
+
+    if _is_not_modified(request, cache_headers, stat):
+        return Response(status_code=304, headers={k: v for k, v in headers.items() if k != "Content-Length"})
 
     # Handle range requests
     if range_header:
-        range_match = re.search(r"bytes=(\d+)-(\d*)", range_header)
-        if range_match:
-            start = int(range_match.group(1))
-            end = int(range_match.group(2)) if range_match.group(2) else file_size - 1
+        byte_range = _parse_range(range_header)
+        if byte_range:
+            start, end = byte_range
+            if end is None:
+                end = file_size - 1
 
             if start >= file_size:
                 raise HTTPException(status_code=416, detail="Range not satisfiable")
@@ -124,7 +226,7 @@ async def serve_audio(audiobook_id: int, request: Request, db: Session = Depends
                     f.seek(start)
                     remaining = end - start + 1
                     while remaining:
-                        chunk_size = min(8192, remaining)
+                        chunk_size = min(AUDIO_CHUNK_SIZE, remaining)
                         chunk = f.read(chunk_size)
                         if not chunk:
                             break
@@ -139,120 +241,98 @@ async def serve_audio(audiobook_id: int, request: Request, db: Session = Depends
             )
 
     # Full file response for non-range requests
-    def iter_file():
-        with open(audiobook.file_path, "rb") as f:
-            while chunk := f.read(8192):
-                yield chunk
-
-    return StreamingResponse(
-        iter_file(),
-        status_code=200,
+    return FileResponse(
+        audiobook.file_path,
         headers=headers,
-        media_type="audio/mp4"
+        media_type="audio/mp4",
+        stat_result=stat
     )
 
-@router.post("/{audiobook_id}/generate-image")
+@router.post("/{audiobook_id}/generate-image", response_model=GenerateImageResponse, status_code=202)
 async def generate_image(
     audiobook_id: int,
+    background_tasks: BackgroundTasks,
     timestamp: float = Form(...),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    """Generate an image at a specific timestamp"""
+    """Start generating an image at a specific timestamp, poll the images endpoint for the result"""
 
     # Get audiobook
-    audiobook = db.query(Audiobook).filter(Audiobook.id == audiobook_id).first()
+    result = await db.execute(select(Audiobook).where(Audiobook.id == audiobook_id))
+    audiobook = result.scalar_one_or_none()
     if not audiobook:
         raise HTTPException(status_code=404, detail="Audiobook not found")
 
     if not os.path.exists(audiobook.file_path):
         raise HTTPException(status_code=404, detail="Audio file not found")
 
-    try:
-        # Initialize services
-        audio_service = AudioService()
-        transcription_service = TranscriptionService()
-        image_service = ImageService()
-
-        # Extract 30-second audio segment ending at the timestamp
-        start_time = max(0, timestamp - 30)
-        audio_data = audio_service.extract_audio_segment(
-            audiobook.file_path,
-            start_time,
-            30.0
-        )
-
-        if not audio_data:
-            raise HTTPException(status_code=500, detail="Failed to extract audio segment")
-
-        # Transcribe the audio
-        transcription = transcription_service.transcribe_audio_segment(audio_data)
-        if not transcription:
-            # Use fallback transcription
-            transcription = transcription_service.create_fallback_transcription(timestamp)
-
-        # Generate image
-        image_result = image_service.generate_image(
-            audiobook.style_prompt,
-            transcription,
-            audiobook_id,
-            int(timestamp)
-        )
-
-        if not image_result:
-            raise HTTPException(status_code=500, detail="Failed to generate image")
-
-        # Save to database
-        generated_image = GeneratedImage(
-            audiobook_id=audiobook_id,
-            timestamp_seconds=int(timestamp),
-            transcription=transcription,
-            image_prompt=image_result["image_prompt"],
-            image_filename=image_result["image_filename"],
-            image_path=image_result["image_path"]
-        )
-
-        db.add(generated_image)
-        db.commit()
-        db.refresh(generated_image)
-
-        return {
-            "message": "Image generated successfully",
-            "image": {
-                "id": generated_image.id,
-                "timestamp_seconds": generated_image.timestamp_seconds,
-                "transcription": generated_image.transcription,
-                "image_filename": generated_image.image_filename,
-                "created_at": generated_image.created_at.isoformat()
-            }
-        }
-
-    except Exception as e:
-        print(f"Error generating image: {e}")
-        raise HTTPException(status_code=500, detail=f"Failed to generate image: {str(e)}")
+    # Record the pending image, the pipeline fills it in after the response is sent
+    generated_image = GeneratedImage(
+        audiobook_id=audiobook_id,
+        timestamp_seconds=int(timestamp),
+        status=IMAGE_STATUS_PENDING
+    )
+
+    db.add(generated_image)
+    await db.commit()
+    await db.refresh(generated_image)
+
+    background_tasks.add_task(generation_service.run, generated_image.id, timestamp)
+
+    return GenerateImageResponse(
+        message="Image generation started",
+        image=GeneratedImageResponse.model_validate(generated_image)
+    )
+
+@router.get("/{audiobook_id}/images", response_model=List[GeneratedImageResponse])
+async def list_images(audiobook_id: int, db: AsyncSession = Depends(get_db)):
+    """List an audiobook's images, including pending and failed generations"""
+
+    audiobook = await db.get(Audiobook, audiobook_id)
+    if not audiobook:
+        raise HTTPException(status_code=404, detail="Audiobook not found")
+
+    result = await db.execute(
+        select(GeneratedImage)
+        .where(GeneratedImage.audiobook_id == audiobook_id)
+        .order_by(GeneratedImage.timestamp_seconds)
+    )
+    return result.scalars().all()
 
 @router.get("/{audiobook_id}/images/{image_filename}")
-async def serve_image(audiobook_id: int, image_filename: str, db: Session = Depends(get_db)):
+async def serve_image(audiobook_id: int, image_filename: str, request: Request, db: AsyncSession = Depends(get_db)):
     """Serve generated image file"""
 
     # Verify the image belongs to this audiobook
-    image = db.query(GeneratedImage).filter(
+    result = await db.execute(select(GeneratedImage).where(
         GeneratedImage.audiobook_id == audiobook_id,
         GeneratedImage.image_filename == image_filename
-    ).first()
+    ))
+    image = result.scalar_one_or_none()
 
     if not image:
         raise HTTPException(status_code=404, detail="Image not found")
 
-    if not os.path.exists(image.image_path):
+    try:
+        stat = os.stat(image.image_path)
+    except FileNotFoundError:
         raise HTTPException(status_code=404, detail="Image file not found")
 
+    headers = {
+        "Access-Control-Allow-Origin": "*",
+        "Access-Control-Allow-Methods": "GET",
+        "Access-Control-Allow-Headers": "*",
+    }
+    cache_headers = _cache_headers(stat, immutable=True)
+    headers.update(cache_headers)
+
+    if _is_not_modified(request, cache_headers, stat):
+        return Response(status_code=304, headers=headers)
+
     return FileResponse(
         image.image_path,
         media_type="image/png",
         filename=image_filename,
-        headers={
-            "Access-Control-Allow-Origin": "*",
-            "Access-Control-Allow-Methods": "GET",
-            "Access-Control-Allow-Headers": "*",
-        }
+        headers=headers,
+        stat_result=stat
     )
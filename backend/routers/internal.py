@@ -0,0 +1,15 @@
+from fastapi import APIRouter, BackgroundTasks
+
+from models.schemas import ReplicateWebhook
+from services.generation_service import generation_service
+
+router = APIRouter(prefix="/internal", tags=["internal"])
+
+@router.post("/replicate-callback")
+async def replicate_callback(payload: ReplicateWebhook, background_tasks: BackgroundTasks):
+    """Receive Replicate's prediction completed webhook"""
+
+    # Acknowledge right away, downloading the image happens after the response
+    background_tasks.add_task(generation_service.complete_prediction, payload.id)
+
+    return {"message": "Webhook received"}
@@ -1,35 +1,80 @@
+import asyncio
+import functools
+import json
 import subprocess
-import tempfile
 import os
-from pathlib import Path
-from typing import Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional, Tuple
+
+# A malformed upload can make ffprobe hang, don't let it hold a probe thread forever
+PROBE_TIMEOUT = 30  # seconds
+
+# Dedicated threads for blocking ffprobe runs, which also caps concurrent ffprobe processes.
+# Created on first use and again after shutdown, so the app can start twice in one process
+_probe_pool: Optional[ThreadPoolExecutor] = None
+
+def _get_probe_pool() -> ThreadPoolExecutor:
+    global _probe_pool
+    if _probe_pool is None:
+        _probe_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="ffprobe")
+    return _probe_pool
+
+@functools.lru_cache(maxsize=512)
+def _probe_cached(file_path: str, mtime_ns: int, size: int) -> Dict[str, Any]:
+    # mtime_ns and size are only part of the cache key, a rewritten file gets probed again
+    cmd = [
+        'ffprobe',
+        '-v', 'quiet',
+        '-print_format', 'json',
+        '-show_format',
+        '-show_streams',
+        file_path
+    ]
+    result = subprocess.run(cmd, capture_output=True, text=True, check=True, timeout=PROBE_TIMEOUT)
+    return json.loads(result.stdout)
 
 class AudioService:
     """Service for audio processing using FFmpeg"""
 
     @staticmethod
-    def get_audio_duration(file_path: str) -> Optional[float]:
+    def probe(file_path: str) -> Dict[str, Any]:
+        """
+        Run ffprobe for both format and stream info in a single call
+
+        Results are cached per (path, mtime, size), so repeat lookups on an
+        unchanged file don't spawn a process. Treat the result as read-only.
+        """
+        stat = os.stat(file_path)
+        return _probe_cached(file_path, stat.st_mtime_ns, stat.st_size)
+
+    @staticmethod
+    async def probe_async(file_path: str) -> Dict[str, Any]:
+        """Run probe on the ffprobe thread pool without blocking the event loop"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_get_probe_pool(), AudioService.probe, file_path)
+
+    @staticmethod
+    def shutdown() -> None:
+        """Stop the ffprobe thread pool, called on app shutdown"""
+        global _probe_pool
+        if _probe_pool is not None:
+            _probe_pool.shutdown(wait=False, cancel_futures=True)
+            _probe_pool = None
+
+    @staticmethod
+    async def get_audio_duration(file_path: str) -> Optional[float]:
         """Get the duration of an audio file in seconds"""
         try:
-            cmd = [
-                'ffprobe',
-                '-v', 'quiet',
-                '-print_format', 'json',
-                '-show_format',
-                file_path
-            ]
-            result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-
-            import json
-            data = json.loads(result.stdout)
+            data = await AudioService.probe_async(file_path)
             duration = float(data['format']['duration'])
             return duration
-        except (subprocess.CalledProcessError, KeyError, ValueError) as e:
+        # RuntimeError covers a probe pool that is shutting down, the upload is saved by now
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired, OSError, KeyError, ValueError, RuntimeError) as e:
             print(f"Error getting audio duration: {e}")
             return None
 
     @staticmethod
-    def extract_audio_segment(file_path: str, start_time: float, duration: float = 30.0) -> Optional[bytes]:
+    async def extract_audio_segment(file_path: str, start_time: float, duration: float = 30.0) -> Optional[bytes]:
         """
         Extract a segment of audio from the file
 
@@ -42,55 +87,38 @@ class AudioService:
             WAV audio data as bytes, or None if extraction fails
         """
         try:
-            # Create temporary file for the extracted segment
-            with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as temp_file:
-                temp_path = temp_file.name
-
-            # FFmpeg command to extract segment and convert to WAV
+            # FFmpeg command to extract segment and write WAV to stdout.
+            # -ss before -i seeks in the demuxer instead of decoding up to start_time
             cmd = [
                 'ffmpeg',
-                '-i', file_path,
                 '-ss', str(start_time),
+                '-i', file_path,
                 '-t', str(duration),
                 '-ar', '16000',  # 16kHz sample rate for Whisper
                 '-ac', '1',      # Mono channel
                 '-f', 'wav',
-                '-y',            # Overwrite output file
-                temp_path
+                'pipe:1'
             ]
 
-            result = subprocess.run(
-                cmd,
-                capture_output=True,
-                text=True,
-                check=True
+            process = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE
             )
+            stdout, stderr = await process.communicate()
 
-            # Read the extracted audio data
-            with open(temp_path, 'rb') as f:
-                audio_data = f.read()
+            if process.returncode != 0:
+                print(f"FFmpeg error: {stderr.decode(errors='replace')}")
+                return None
 
-            # Clean up temporary file
-            os.unlink(temp_path)
+            return stdout
 
-            return audio_data
-
-        except subprocess.CalledProcessError as e:
-            print(f"FFmpeg error: {e.stderr}")
-            return None
         except Exception as e:
             print(f"Error extracting audio segment: {e}")
             return None
-        finally:
-            # Ensure cleanup even if an error occurs
-            if 'temp_path' in locals() and os.path.exists(temp_path):
-                try:
-                    os.unlink(temp_path)
-                except:
-                    pass
 
     @staticmethod
-    def validate_audio_file(file_path: str) -> Tuple[bool, Optional[str]]:
+    async def validate_audio_file(file_path: str) -> Tuple[bool, Optional[str]]:
         """
         Validate that the file is a valid audio file
 
@@ -98,18 +126,7 @@ class AudioService:
             (is_valid, error_message)
         """
         try:
-            cmd = [
-                'ffprobe',
-                '-v', 'quiet',
-                '-print_format', 'json',
-                '-show_streams',
-                file_path
-            ]
-
-            result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-
-            import json
-            data = json.loads(result.stdout)
+            data = await AudioService.probe_async(file_path)
 
             # Check if there's at least one audio stream
             audio_streams = [s for s in data.get('streams', []) if s.get('codec_type') == 'audio']
@@ -121,5 +138,9 @@ class AudioService:
 
         except subprocess.CalledProcessError as e:
             return False, f"Invalid audio file: {e.stderr}"
+        except subprocess.TimeoutExpired:
+            return False, "Invalid audio file: probing timed out"
         except Exception as e:
-            return False, f"Error validating audio file: {str(e)}"
\ No newline at end of file
+            return False, f"Error validating audio file: {str(e)}"
+
+audio_service = AudioService()
\ No newline at end of file
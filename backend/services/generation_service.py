@@ -0,0 +1,245 @@
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict
+from sqlalchemy import select, update
+from config.settings import settings
+from models.database import (
+    SessionLocal,
+    Audiobook,
+    GeneratedImage,
+    IMAGE_STATUS_PENDING,
+    IMAGE_STATUS_COMPLETED,
+    IMAGE_STATUS_FAILED,
+)
+from services.audio_service import audio_service
+from services.transcription_service import transcription_service
+from services.image_service import image_service
+from services.storage_service import storage_service
+
+# How often the webhook fallback checks whether the webhook already completed the image
+WEBHOOK_CHECK_INTERVAL = 2.0  # seconds
+
+# A webhook can arrive before its prediction_id is committed, retry the lookup this long
+PREDICTION_LOOKUP_ATTEMPTS = 5
+PREDICTION_LOOKUP_DELAY = 1.0  # seconds
+
+class GenerationService:
+    """Runs the extract -> transcribe -> generate pipeline for a pending image"""
+
+    async def run(self, image_id: int, timestamp: float) -> None:
+        """
+        Fill in a pending GeneratedImage row, meant to run as a background task
+
+        The DB session is only held while reading and writing the row, not
+        for the (potentially minute long) pipeline in between. With
+        settings.public_base_url set, the prediction is finished by the
+        Replicate webhook and this only polls if the webhook never arrives.
+
+        Args:
+            image_id: ID of the pending GeneratedImage row
+            timestamp: Playback position in seconds the image is generated for
+        """
+        async with SessionLocal() as db:
+            image = await db.get(GeneratedImage, image_id)
+            audiobook = await db.get(Audiobook, image.audiobook_id) if image else None
+
+        if not image or not audiobook:
+            return
+
+        try:
+            transcription = await self._transcribe(audiobook, timestamp)
+
+            if not settings.public_base_url:
+                values = await self._generate(audiobook, transcription, timestamp)
+                if not await self._update(image_id, {**values, "status": IMAGE_STATUS_COMPLETED}):
+                    # The row was deleted with its audiobook meanwhile, don't orphan the image
+                    storage_service.delete_file(values["image_path"])
+                return
+
+            prediction_id = await self._start_prediction(image_id, audiobook, transcription)
+        except Exception as e:
+            print(f"Error generating image: {e}")
+            await self._update(image_id, {"status": IMAGE_STATUS_FAILED, "error": str(e)})
+            return
+
+        # Fallback for a webhook that never arrives. Checks in short sleeps so the
+        # task ends soon after the webhook completed the image, instead of holding
+        # up a graceful shutdown for the whole timeout
+        deadline = time.monotonic() + settings.replicate_webhook_timeout
+        while time.monotonic() < deadline:
+            await asyncio.sleep(WEBHOOK_CHECK_INTERVAL)
+            if not await self._is_pending(image_id):
+                return
+
+        await self.complete_prediction(prediction_id)
+
+    async def complete_prediction(self, prediction_id: str) -> None:
+        """
+        Download the image of a finished prediction into its pending row
+
+        Called from the Replicate webhook and as the polling fallback. The
+        prediction is re-fetched from the API rather than trusted from the
+        webhook body. The row lookup is retried briefly, as a fast webhook
+        can arrive before _start_prediction has committed the prediction_id.
+
+        Args:
+            prediction_id: ID of the Replicate prediction
+        """
+        image = None
+        for attempt in range(PREDICTION_LOOKUP_ATTEMPTS):
+            if attempt:
+                await asyncio.sleep(PREDICTION_LOOKUP_DELAY)
+            async with SessionLocal() as db:
+                result = await db.execute(
+                    select(GeneratedImage).where(GeneratedImage.prediction_id == prediction_id)
+                )
+                image = result.scalar_one_or_none()
+            if image:
+                break
+
+        if not image or image.status != IMAGE_STATUS_PENDING:
+            return
+
+        finished = await image_service.finish_generation(
+            prediction_id,
+            image.audiobook_id,
+            image.timestamp_seconds
+        )
+
+        if finished:
+            values = {**finished, "status": IMAGE_STATUS_COMPLETED}
+        else:
+            values = {"status": IMAGE_STATUS_FAILED, "error": "Failed to generate image"}
+
+        if not await self._update(image.id, values) and finished:
+            # The webhook and the fallback both finished it, keep only the first image
+            storage_service.delete_file(finished["image_path"])
+
+    async def fail_stale(self) -> int:
+        """
+        Mark pending images whose pipeline can no longer finish as failed
+
+        Pending rows are only completed by the in-process task that created
+        them, so a worker restart or crash leaves them pending for good.
+        Called on startup, it only touches rows older than
+        settings.image_stale_after, which keeps it from failing images
+        another worker is still generating.
+
+        Returns:
+            Number of images marked as failed
+        """
+        # created_at is stored as naive UTC
+        cutoff = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(seconds=settings.image_stale_after)
+
+        async with SessionLocal() as db:
+            result = await db.execute(
+                update(GeneratedImage)
+                .where(
+                    GeneratedImage.status == IMAGE_STATUS_PENDING,
+                    GeneratedImage.created_at < cutoff
+                )
+                .values(status=IMAGE_STATUS_FAILED, error="Image generation was interrupted")
+            )
+            await db.commit()
+
+        return result.rowcount
+
+    async def _transcribe(self, audiobook: Audiobook, timestamp: float) -> str:
+        """
+        Transcribe the 30 seconds of audio leading up to the timestamp
+
+        Raises:
+            RuntimeError: If the audio segment can't be extracted
+        """
+        # Extract 30-second audio segment ending at the timestamp
+        start_time = max(0, timestamp - 30)
+        audio_data = await audio_service.extract_audio_segment(
+            audiobook.file_path,
+            start_time,
+            30.0
+        )
+
+        if not audio_data:
+            raise RuntimeError("Failed to extract audio segment")
+
+        # Transcribe the audio
+        transcription = await transcription_service.transcribe_audio_segment(audio_data)
+        if not transcription:
+            # Use fallback transcription
+            transcription = transcription_service.create_fallback_transcription(timestamp)
+
+        return transcription
+
+    async def _generate(self, audiobook: Audiobook, transcription: str, timestamp: float) -> Dict[str, Any]:
+        """
+        Generate the image by polling, producing the column values of a finished image
+
+        Raises:
+            RuntimeError: If image generation fails
+        """
+        image_result = await image_service.generate_image(
+            audiobook.style_prompt,
+            transcription,
+            audiobook.id,
+            int(timestamp)
+        )
+
+        if not image_result:
+            raise RuntimeError("Failed to generate image")
+
+        return {
+            "transcription": transcription,
+            "image_prompt": image_result["image_prompt"],
+            "image_filename": image_result["image_filename"],
+            "image_path": image_result["image_path"],
+        }
+
+    async def _start_prediction(self, image_id: int, audiobook: Audiobook, transcription: str) -> str:
+        """
+        Create a webhook-reported prediction and record it on the pending row
+
+        Raises:
+            RuntimeError: If the prediction can't be created
+        """
+        started = await image_service.start_generation(
+            audiobook.style_prompt,
+            transcription,
+            webhook_url=f"{settings.public_base_url.rstrip('/')}/internal/replicate-callback"
+        )
+
+        if not started:
+            raise RuntimeError("Failed to generate image")
+
+        await self._update(image_id, {
+            "transcription": transcription,
+            "image_prompt": started["image_prompt"],
+            "prediction_id": started["prediction_id"],
+        })
+
+        return started["prediction_id"]
+
+    async def _is_pending(self, image_id: int) -> bool:
+        """Check if an image row still exists and is pending"""
+        async with SessionLocal() as db:
+            result = await db.execute(
+                select(GeneratedImage.status).where(GeneratedImage.id == image_id)
+            )
+            return result.scalar_one_or_none() == IMAGE_STATUS_PENDING
+
+    async def _update(self, image_id: int, values: Dict[str, Any]) -> bool:
+        """Update a still pending image row, returns False if it was no longer pending"""
+        async with SessionLocal() as db:
+            result = await db.execute(
+                update(GeneratedImage)
+                .where(
+                    GeneratedImage.id == image_id,
+                    GeneratedImage.status == IMAGE_STATUS_PENDING
+                )
+                .values(**values)
+            )
+            await db.commit()
+
+        return result.rowcount > 0
+
+generation_service = GenerationService()
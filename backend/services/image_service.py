@@ -1,9 +1,21 @@
+import asyncio
 import os
-import requests
-import uuid
+import time
+import aiofiles
+import httpx
+import orjson
 from pathlib import Path
 from typing import Optional, Dict, Any
 
+# Backoff bounds for prediction polling, in seconds
+POLL_INITIAL_DELAY = 0.25
+POLL_MAX_DELAY = 2.0
+
+DOWNLOAD_CHUNK_SIZE = 64 * 1024  # 64KB
+
+# Appended to every image prompt
+QUALITY_TERMS = "highly detailed, professional quality, artistic composition"
+
 class ImageService:
     """Service for generating images using Replicate API"""
 
@@ -11,9 +23,48 @@ class ImageService:
         self.api_token = os.getenv("REPLICATE_API_TOKEN")
         self.base_url = "https://api.replicate.com/v1"
 
-    def generate_image(self, style_prompt: str, transcription: str, audiobook_id: int, timestamp: int) -> Optional[Dict[str, Any]]:
+        # Created once here instead of on every saved image
+        self.images_dir = Path("uploads/images")
+        self.images_dir.mkdir(parents=True, exist_ok=True)
+
+        # Only sent to the Replicate API, not to the CDN the images are downloaded from
+        self.api_headers = {
+            "Authorization": f"Token {self.api_token}",
+            "Content-Type": "application/json"
+        }
+
+        # Built on first use and again after aclose, so an app that starts twice
+        # in one process doesn't end up with a closed client
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """The shared HTTP client, (re)built if there is no open one"""
+        if self._client is None or self._client.is_closed:
+            # One pooled async client so concurrent generations share keep-alive connections.
+            # HTTP/2 multiplexes polls and downloads to the same host over one connection,
+            # idle connections are dropped before the server side is likely to close them.
+            # The pool lives on the transport, client-level limits are ignored once one is passed
+            limits = httpx.Limits(
+                max_connections=50,
+                max_keepalive_connections=20,
+                keepalive_expiry=30
+            )
+            self._client = httpx.AsyncClient(
+                timeout=30,
+                transport=httpx.AsyncHTTPTransport(http2=True, limits=limits, retries=3)
+            )
+        return self._client
+
+    async def aclose(self) -> None:
+        """Close the HTTP client, called on app shutdown"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def generate_image(self, style_prompt: str, transcription: str, audiobook_id: int, timestamp: int) -> Optional[Dict[str, Any]]:
         """
-        Generate an image based on style prompt and transcription
+        Generate an image based on style prompt and transcription, polling until it's done
 
         Args:
             style_prompt: User's artistic style description
@@ -24,37 +75,84 @@ class ImageService:
         Returns:
             Dictionary with image info or None if generation fails
         """
-        if not self.api_token:
-            print("Warning: REPLICATE_API_TOKEN not set. Image generation will fail.")
-            return None
-
         try:
-            # Construct the full prompt
-            full_prompt = self._construct_prompt(style_prompt, transcription)
+            started = await self.start_generation(style_prompt, transcription)
 
-            # Make API request to Replicate
-            response = self._call_replicate_api(full_prompt)
-
-            if not response:
+            if not started:
                 return None
 
-            # Download and save the generated image
-            image_filename = f"{audiobook_id}_{timestamp}_{uuid.uuid4().hex[:8]}.png"
-            image_path = self._save_image(response, image_filename)
+            finished = await self.finish_generation(started["prediction_id"], audiobook_id, timestamp)
 
-            if not image_path:
+            if not finished:
                 return None
 
-            return {
-                "image_filename": image_filename,
-                "image_path": image_path,
-                "image_prompt": full_prompt
-            }
+            return {**finished, "image_prompt": started["image_prompt"]}
 
         except Exception as e:
             print(f"Error generating image: {e}")
             return None
 
+    async def start_generation(self, style_prompt: str, transcription: str, webhook_url: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        Create a prediction without waiting for it
+
+        Args:
+            style_prompt: User's artistic style description
+            transcription: Transcribed audio content
+            webhook_url: URL Replicate calls once the prediction completes
+
+        Returns:
+            Dictionary with prediction_id and image_prompt, or None if the request fails
+        """
+        if not self.api_token:
+            print("Warning: REPLICATE_API_TOKEN not set. Image generation will fail.")
+            return None
+
+        # Construct the full prompt
+        full_prompt = self._construct_prompt(style_prompt, transcription)
+
+        # Make API request to Replicate
+        prediction_id = await self._call_replicate_api(full_prompt, webhook_url)
+
+        if not prediction_id:
+            return None
+
+        return {
+            "prediction_id": prediction_id,
+            "image_prompt": full_prompt
+        }
+
+    async def finish_generation(self, prediction_id: str, audiobook_id: int, timestamp: int) -> Optional[Dict[str, Any]]:
+        """
+        Wait for a prediction and download its image
+
+        Costs a single request when the prediction has already completed.
+
+        Args:
+            prediction_id: ID of the prediction
+            audiobook_id: ID of the audiobook
+            timestamp: Timestamp in seconds
+
+        Returns:
+            Dictionary with image_filename and image_path, or None if generation fails
+        """
+        image_url = await self._poll_prediction(prediction_id)
+
+        if not image_url:
+            return None
+
+        # Download and save the generated image
+        image_filename = f"{audiobook_id}_{timestamp}_{os.urandom(4).hex()}.png"
+        image_path = await self._save_image(image_url, image_filename)
+
+        if not image_path:
+            return None
+
+        return {
+            "image_filename": image_filename,
+            "image_path": image_path
+        }
+
     def _construct_prompt(self, style_prompt: str, transcription: str) -> str:
         """
         Construct a comprehensive prompt for image generation
@@ -66,35 +164,27 @@ class ImageService:
         Returns:
             Complete prompt for image generation
         """
-        # Clean and limit the transcription
-        clean_transcription = transcription.strip()
-        if len(clean_transcription) > 200:
-            clean_transcription = clean_transcription[:200] + "..."
+        # Clean and limit the transcription, only the kept prefix gets stripped
+        text = transcription.lstrip()
+        clean_transcription = text[:200].rstrip()
+        if len(text) > 200:
+            clean_transcription += "..."
 
-        # Construct the prompt
-        prompt = f"{style_prompt}, {clean_transcription}"
+        # Construct the prompt with quality modifiers
+        return ", ".join((style_prompt, clean_transcription, QUALITY_TERMS))
 
-        # Add quality modifiers
-        quality_terms = "highly detailed, professional quality, artistic composition"
-
-        return f"{prompt}, {quality_terms}"
-
-    def _call_replicate_api(self, prompt: str) -> Optional[str]:
+    async def _call_replicate_api(self, prompt: str, webhook_url: Optional[str] = None) -> Optional[str]:
         """
-        Call Replicate API to generate image
+        Call Replicate API to create an image prediction
 
         Args:
             prompt: The complete prompt for image generation
+            webhook_url: URL Replicate calls once the prediction completes
 
         Returns:
-            URL of generated image or None if failed
+            ID of the prediction or None if failed
         """
         try:
-            headers = {
-                "Authorization": f"Token {self.api_token}",
-                "Content-Type": "application/json"
-            }
-
             # Using Stable Diffusion XL model
             payload = {
                 "version": "39ed52f2a78e934b3ba6e2a89f5b1c712de7dfea535525255b1aa35c5565e08b",
@@ -109,47 +199,51 @@ class ImageService:
                 }
             }
 
+            if webhook_url:
+                payload["webhook"] = webhook_url
+                payload["webhook_events_filter"] = ["completed"]
+
             # Create prediction
-            response = requests.post(
+            response = await self.client.post(
                 f"{self.base_url}/predictions",
-                headers=headers,
-                json=payload,
-                timeout=30
+                headers=self.api_headers,
+                json=payload
             )
 
             if response.status_code != 201:
                 print(f"Replicate API error: {response.status_code} - {response.text}")
                 return None
 
-            prediction = response.json()
-            prediction_id = prediction["id"]
-
-            # Poll for completion
-            return self._poll_prediction(prediction_id, headers)
+            prediction = orjson.loads(response.content)
+            return prediction["id"]
 
         except Exception as e:
             print(f"Error calling Replicate API: {e}")
             return None
 
-    def _poll_prediction(self, prediction_id: str, headers: Dict[str, str], max_attempts: int = 60) -> Optional[str]:
+    async def _poll_prediction(self, prediction_id: str, timeout: float = 120.0) -> Optional[str]:
         """
         Poll Replicate API for prediction completion
 
+        Polls back off exponentially from POLL_INITIAL_DELAY up to
+        POLL_MAX_DELAY, a Retry-After header from the API takes precedence.
+
         Args:
             prediction_id: ID of the prediction
-            headers: Request headers
-            max_attempts: Maximum polling attempts
+            timeout: Wall-clock budget for polling in seconds
 
         Returns:
             URL of generated image or None if failed/timeout
         """
-        import time
+        deadline = time.monotonic() + timeout
+        delay = POLL_INITIAL_DELAY
 
-        for attempt in range(max_attempts):
+        while time.monotonic() < deadline:
+            retry_after = None
             try:
-                response = requests.get(
+                response = await self.client.get(
                     f"{self.base_url}/predictions/{prediction_id}",
-                    headers=headers,
+                    headers=self.api_headers,
                     timeout=10
                 )
 
@@ -157,7 +251,7 @@ class ImageService:
                     print(f"Error polling prediction: {response.status_code}")
                     return None
 
-                result = response.json()
+                result = orjson.loads(response.content)
                 status = result.get("status")
 
                 if status == "succeeded":
@@ -170,22 +264,34 @@ class ImageService:
                     print(f"Image generation failed: {result.get('error', 'Unknown error')}")
                     return None
 
-                elif status in ["starting", "processing"]:
-                    time.sleep(2)  # Wait 2 seconds before next poll
-                    continue
-
-                else:
+                elif status not in ["starting", "processing"]:
                     print(f"Unknown prediction status: {status}")
                     return None
 
+                retry_after = self._parse_retry_after(response.headers.get("Retry-After"))
+
             except Exception as e:
                 print(f"Error polling prediction: {e}")
-                time.sleep(2)
+
+            # Wait before next poll, never past the deadline
+            wait = retry_after if retry_after is not None else delay
+            await asyncio.sleep(max(0.0, min(wait, deadline - time.monotonic())))
+            delay = min(delay * 1.5, POLL_MAX_DELAY)
 
         print("Image generation timed out")
         return None
 
-    def _save_image(self, image_url: str, filename: str) -> Optional[str]:
+    @staticmethod
+    def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+        """Parse a Retry-After header given in seconds, None if missing or not numeric"""
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            return None
+
+    async def _save_image(self, image_url: str, filename: str) -> Optional[str]:
         """
         Download and save image from URL
 
@@ -196,23 +302,28 @@ class ImageService:
         Returns:
             Local file path or None if failed
         """
-        try:
-            # Create images directory if it doesn't exist
-            images_dir = Path("uploads/images")
-            images_dir.mkdir(parents=True, exist_ok=True)
-
-            file_path = images_dir / filename
+        file_path = self.images_dir / filename
+        # Written under a temporary name and renamed, so the final path never holds a partial PNG
+        part_path = f"{file_path}.part"
 
-            # Download the image
-            response = requests.get(image_url, timeout=30)
-            response.raise_for_status()
+        try:
+            # Stream the download to disk instead of buffering the whole PNG
+            async with self.client.stream("GET", image_url, follow_redirects=True) as response:
+                response.raise_for_status()
+                async with aiofiles.open(part_path, 'wb') as f:
+                    async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+                        await f.write(chunk)
 
-            # Save to file
-            with open(file_path, 'wb') as f:
-                f.write(response.content)
+            os.replace(part_path, file_path)
 
             return str(file_path)
 
         except Exception as e:
             print(f"Error saving image: {e}")
-            return None
\ No newline at end of file
+            try:
+                os.remove(part_path)
+            except OSError:
+                pass
+            return None
+
+image_service = ImageService()
\ No newline at end of file
@@ -1,9 +1,15 @@
+import asyncio
 import os
-import uuid
-import aiofiles
+import sys
+from typing import BinaryIO
 from fastapi import UploadFile, HTTPException
 from config.settings import settings
 
+CHUNK_SIZE = 1024 * 1024  # 1MB
+
+# sendfile between two regular files is Linux only, elsewhere it needs a socket target
+SENDFILE_TO_FILE = sys.platform.startswith("linux") and hasattr(os, "sendfile")
+
 class StorageService:
     def __init__(self):
         self.upload_dir = settings.upload_dir
@@ -13,51 +19,103 @@ class StorageService:
         # Ensure directories exist
         os.makedirs(self.audio_dir, exist_ok=True)
         os.makedirs(self.images_dir, exist_ok=True)
+        
+        # Directory prefixes with trailing separator, lookups just concatenate
+        self._audio_prefix = os.path.join(self.audio_dir, "")
+        self._image_prefix = os.path.join(self.images_dir, "")
+        
+        # Constant-time content type checks, the rejection message never changes
+        self._allowed_audio_types = frozenset(settings.allowed_audio_types)
+        self._invalid_type_detail = f"Invalid file type. Allowed types: {settings.allowed_audio_types}"
     
     async def save_audio_file(self, file: UploadFile) -> tuple[str, str]:
         """
         Save uploaded audio file and return (filename, file_path)
         """
         # Validate file type
-        if file.content_type not in settings.allowed_audio_types:
-            raise HTTPException(
-                status_code=400, 
-                detail=f"Invalid file type. Allowed types: {settings.allowed_audio_types}"
-            )
+        if file.content_type not in self._allowed_audio_types:
+            raise HTTPException(status_code=400, detail=self._invalid_type_detail)
+        
+        # Reject oversized uploads up front when the size is already known
+        if file.size is not None and file.size > settings.max_file_size:
+            raise self._file_too_large()
         
         # Generate unique filename
         file_extension = os.path.splitext(file.filename)[1]
-        unique_filename = f"{uuid.uuid4()}{file_extension}"
+        unique_filename = f"{os.urandom(8).hex()}{file_extension}"
         file_path = os.path.join(self.audio_dir, unique_filename)
         
-        # Save file
-        async with aiofiles.open(file_path, 'wb') as f:
-            content = await file.read()
-            if len(content) > settings.max_file_size:
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"File too large. Maximum size: {settings.max_file_size / (1024*1024):.0f}MB"
-                )
-            await f.write(content)
+        # Copy on one worker thread instead of a thread hop per chunk read and write
+        try:
+            await asyncio.to_thread(self._copy_upload, file.file, file_path)
+        except BaseException:
+            # Don't leave a partial upload behind
+            self.delete_file(file_path)
+            raise
         
         return unique_filename, file_path
     
     def get_audio_file_path(self, filename: str) -> str:
         """Get full path to audio file"""
-        return os.path.join(self.audio_dir, filename)
+        return self._audio_prefix + self._check_filename(filename)
     
     def get_image_file_path(self, filename: str) -> str:
         """Get full path to image file"""
-        return os.path.join(self.images_dir, filename)
+        return self._image_prefix + self._check_filename(filename)
+    
+    @staticmethod
+    def _copy_upload(source: BinaryIO, file_path: str) -> None:
+        """
+        Copy the spooled upload to file_path, blocking, meant to be run off the event loop
+
+        Uploads spooled to disk are copied in the kernel with sendfile on
+        Linux, small in-memory ones go through CHUNK_SIZE reads. Either way
+        memory stays bounded by CHUNK_SIZE.
+        """
+        source.flush()
+        source.seek(0)
+        total_size = 0
+
+        with open(file_path, 'wb') as dest:
+            # _rolled is how Starlette itself tells a spooled file is backed by a real fd
+            if SENDFILE_TO_FILE and getattr(source, "_rolled", False):
+                in_fd, out_fd = source.fileno(), dest.fileno()
+                while sent := os.sendfile(out_fd, in_fd, total_size, CHUNK_SIZE):
+                    total_size += sent
+                    # Backstop for uploads whose size wasn't known up front
+                    if total_size > settings.max_file_size:
+                        raise StorageService._file_too_large()
+                return
+
+            while chunk := source.read(CHUNK_SIZE):
+                total_size += len(chunk)
+                # Backstop for uploads whose size wasn't known up front
+                if total_size > settings.max_file_size:
+                    raise StorageService._file_too_large()
+                dest.write(chunk)
+
+    @staticmethod
+    def _file_too_large() -> HTTPException:
+        return HTTPException(
+            status_code=413,
+            detail=f"File too large. Maximum size: {settings.max_file_size / (1024*1024):.0f}MB"
+        )
+    
+    @staticmethod
+    def _check_filename(filename: str) -> str:
+        """Reject names that would escape the directory when concatenated onto a prefix"""
+        if not filename or "/" in filename or os.sep in filename or filename in (".", ".."):
+            raise ValueError(f"Invalid filename: {filename!r}")
+        return filename
     
     def delete_file(self, file_path: str) -> bool:
         """Delete file if it exists"""
         try:
-            if os.path.exists(file_path):
-                os.remove(file_path)
-                return True
+            os.remove(file_path)
+            return True
+        except FileNotFoundError:
             return False
-        except Exception:
+        except OSError:
             return False
 
 storage_service = StorageService()
\ No newline at end of file
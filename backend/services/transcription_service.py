@@ -1,17 +1,41 @@
+import asyncio
+import bisect
+import io
 import os
-import tempfile
+import wave
 import openai
-from typing import Optional
+from typing import List, Optional, Tuple
+
+# Upper bound on concurrent Whisper requests in transcribe_many
+MAX_CONCURRENT_TRANSCRIPTIONS = 8
+
+# Whisper API upload limit, larger batches are sent segment by segment
+WHISPER_MAX_UPLOAD_BYTES = 25 * 1024 * 1024  # 25MB
 
 class TranscriptionService:
     """Service for transcribing audio using OpenAI Whisper API"""
 
     def __init__(self):
-        self.client = openai.OpenAI(
-            api_key=os.getenv("OPENAI_API_KEY")
-        )
+        self.api_key = os.getenv("OPENAI_API_KEY")
+        # Built on first use and again after aclose, so an app that starts twice
+        # in one process doesn't end up with a closed client
+        self._client: Optional[openai.AsyncOpenAI] = None
+
+    @property
+    def client(self) -> Optional[openai.AsyncOpenAI]:
+        """The API client, (re)built if there is no open one, None without an API key"""
+        # The client refuses to construct without a key, so only build it when one is set
+        if self.api_key and (self._client is None or self._client.is_closed()):
+            self._client = openai.AsyncOpenAI(api_key=self.api_key)
+        return self._client
 
-    def transcribe_audio_segment(self, audio_data: bytes) -> Optional[str]:
+    async def aclose(self) -> None:
+        """Close the API client, called on app shutdown"""
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
+    async def transcribe_audio_segment(self, audio_data: bytes) -> Optional[str]:
         """
         Transcribe audio data using Whisper API
 
@@ -21,39 +45,137 @@ class TranscriptionService:
         Returns:
             Transcribed text or None if transcription fails
         """
-        if not os.getenv("OPENAI_API_KEY"):
+        if not self.client:
             print("Warning: OPENAI_API_KEY not set. Transcription will fail.")
             return None
 
         try:
-            # Create temporary file for the audio data
-            with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as temp_file:
-                temp_file.write(audio_data)
-                temp_path = temp_file.name
-
-            # Transcribe using Whisper API
-            with open(temp_path, 'rb') as audio_file:
-                transcript = self.client.audio.transcriptions.create(
-                    model="whisper-1",
-                    file=audio_file,
-                    response_format="text"
-                )
-
-            # Clean up temporary file
-            os.unlink(temp_path)
+            # The SDK takes a (filename, content, mimetype) tuple, no temp file needed
+            transcript = await self.client.audio.transcriptions.create(
+                model="whisper-1",
+                file=("audio.wav", audio_data, "audio/wav"),
+                response_format="text"
+            )
 
             return transcript.strip() if transcript else None
 
         except Exception as e:
             print(f"Error transcribing audio: {e}")
             return None
-        finally:
-            # Ensure cleanup even if an error occurs
-            if 'temp_path' in locals() and os.path.exists(temp_path):
-                try:
-                    os.unlink(temp_path)
-                except:
-                    pass
+
+    async def transcribe_many(self, segments: List[bytes]) -> List[Optional[str]]:
+        """
+        Transcribe several audio segments concurrently
+
+        Args:
+            segments: WAV audio data for each segment
+
+        Returns:
+            Transcriptions in the same order as segments, None where one failed
+        """
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_TRANSCRIPTIONS)
+
+        async def transcribe(audio_data: bytes) -> Optional[str]:
+            async with semaphore:
+                return await self.transcribe_audio_segment(audio_data)
+
+        return await asyncio.gather(*(transcribe(segment) for segment in segments))
+
+    async def transcribe_batch(self, segments: List[bytes]) -> List[Optional[str]]:
+        """
+        Transcribe contiguous audio segments with a single Whisper request
+
+        The segments are joined into one WAV and the verbose_json segment
+        timestamps are mapped back onto the input segments, which saves a
+        round trip per segment. Falls back to transcribe_many when the joined
+        audio exceeds the Whisper upload limit or can't be joined.
+
+        Args:
+            segments: WAV audio data for each segment, all in the same format
+
+        Returns:
+            Transcriptions in the same order as segments, None where nothing was heard
+        """
+        if not self.client:
+            print("Warning: OPENAI_API_KEY not set. Transcription will fail.")
+            return [None] * len(segments)
+
+        if not segments:
+            return []
+
+        try:
+            audio_data, boundaries = self._concatenate_wav(segments)
+        except (wave.Error, EOFError, ValueError) as e:
+            print(f"Error joining audio segments: {e}")
+            return await self.transcribe_many(segments)
+
+        if len(audio_data) > WHISPER_MAX_UPLOAD_BYTES:
+            return await self.transcribe_many(segments)
+
+        try:
+            transcript = await self.client.audio.transcriptions.create(
+                model="whisper-1",
+                file=("audio.wav", audio_data, "audio/wav"),
+                response_format="verbose_json"
+            )
+        except Exception as e:
+            print(f"Error transcribing audio: {e}")
+            return [None] * len(segments)
+
+        # Assign each Whisper segment to the input segment it starts in
+        texts: List[List[str]] = [[] for _ in segments]
+        for whisper_segment in getattr(transcript, "segments", None) or []:
+            if isinstance(whisper_segment, dict):
+                start, text = whisper_segment["start"], whisper_segment["text"]
+            else:
+                start, text = whisper_segment.start, whisper_segment.text
+            index = max(0, bisect.bisect_right(boundaries, start) - 1)
+            texts[index].append(text.strip())
+
+        return [" ".join(parts) or None for parts in texts]
+
+    @staticmethod
+    def _concatenate_wav(segments: List[bytes]) -> Tuple[bytes, List[float]]:
+        """
+        Join WAV segments into one WAV file
+
+        Frame counts come from the data actually read, since WAVs piped out
+        of ffmpeg carry placeholder sizes in their headers.
+
+        Returns:
+            (wav_bytes, start time in seconds of each segment)
+
+        Raises:
+            ValueError: If the segments don't share one audio format
+        """
+        params = None
+        frames: List[bytes] = []
+        boundaries: List[float] = []
+        offset = 0.0
+
+        for segment in segments:
+            with wave.open(io.BytesIO(segment), "rb") as reader:
+                segment_params = (reader.getnchannels(), reader.getsampwidth(), reader.getframerate())
+                if params is None:
+                    params = segment_params
+                elif segment_params != params:
+                    raise ValueError("Audio segments have different formats")
+                data = reader.readframes(reader.getnframes())
+
+            nchannels, sampwidth, framerate = params
+            boundaries.append(offset)
+            offset += len(data) / (nchannels * sampwidth * framerate)
+            frames.append(data)
+
+        nchannels, sampwidth, framerate = params
+        output = io.BytesIO()
+        with wave.open(output, "wb") as writer:
+            writer.setnchannels(nchannels)
+            writer.setsampwidth(sampwidth)
+            writer.setframerate(framerate)
+            writer.writeframes(b"".join(frames))
+
+        return output.getvalue(), boundaries
 
     def create_fallback_transcription(self, timestamp: float) -> str:
         """
@@ -67,4 +189,6 @@ class TranscriptionService:
         """
         minutes = int(timestamp // 60)
         seconds = int(timestamp % 60)
-        return f"Audio content at {minutes:02d}:{seconds:02d} - transcription unavailable"
\ No newline at end of file
+        return f"Audio content at {minutes:02d}:{seconds:02d} - transcription unavailable"
+
+transcription_service = TranscriptionService()
\ No newline at end of file
@@ -9,6 +9,10 @@ import { apiService } from '@/lib/api';
 import { Audiobook, GeneratedImage } from '@/lib/types';
 import { useState, useEffect } from 'react';
 
+// Generation runs in the background on the server, poll until it settles
+const IMAGE_POLL_INTERVAL_MS = 2000;
+const IMAGE_POLL_TIMEOUT_MS = 5 * 60 * 1000;
+
 interface AudioPlayerProps {
 	audiobook: Audiobook;
 	onImageGenerated?: (image: GeneratedImage) => void;
@@ -36,7 +40,8 @@ export function AudioPlayer({ audiobook, onImageGenerated }: AudioPlayerProps) {
 		const fetchImages = async () => {
 			try {
 				const audiobookWithImages = await apiService.getAudiobook(audiobook.id);
-				setGeneratedImages(audiobookWithImages.images || []);
+				const images = audiobookWithImages.images || [];
+				setGeneratedImages(images.filter((image) => image.status === 'completed'));
 			} catch (error) {
 				console.error('Failed to fetch generated images:', error);
 			}
@@ -66,22 +71,33 @@ export function AudioPlayer({ audiobook, onImageGenerated }: AudioPlayerProps) {
 		setVolume(newVolume);
 	};
 
+	const waitForImage = async (imageId: number): Promise<GeneratedImage> => {
+		const deadline = Date.now() + IMAGE_POLL_TIMEOUT_MS;
+		while (Date.now() < deadline) {
+			await new Promise((resolve) => setTimeout(resolve, IMAGE_POLL_INTERVAL_MS));
+			const images = await apiService.getImages(audiobook.id);
+			const image = images.find((img) => img.id === imageId);
+			if (!image) {
+				throw new Error('Generated image not found');
+			}
+			if (image.status !== 'pending') {
+				return image;
+			}
+		}
+		throw new Error('Image generation timed out');
+	};
+
 	const handleGenerateImage = async () => {
 		if (isGeneratingImage || currentTime === 0) return;
 
 		setIsGeneratingImage(true);
 		try {
 			const result = await apiService.generateImage(audiobook.id, currentTime);
-			const newImage: GeneratedImage = {
-				id: result.image.id,
-				audiobook_id: audiobook.id,
-				timestamp_seconds: result.image.timestamp_seconds,
-				transcription: result.image.transcription,
-				image_prompt: '',
-				image_filename: result.image.image_filename,
-				image_path: '',
-				created_at: result.image.created_at
-			};
+			const newImage = await waitForImage(result.image.id);
+
+			if (newImage.status === 'failed') {
+				throw new Error(newImage.error || 'Image generation failed');
+			}
 
 			setGeneratedImages(prev => [...prev, newImage]);
 			onImageGenerated?.(newImage);
@@ -213,7 +229,7 @@ export function AudioPlayer({ audiobook, onImageGenerated }: AudioPlayerProps) {
 									onClick={() => handleImageClick(image.timestamp_seconds)}
 								>
 									<img
-										src={apiService.getImageUrl(audiobook.id, image.image_filename)}
+										src={apiService.getImageUrl(audiobook.id, image.image_filename ?? '')}
 										alt={`Generated at ${formatTime(image.timestamp_seconds)}`}
 										className="w-full h-32 object-cover"
 										onError={(e) => {
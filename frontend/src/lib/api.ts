@@ -1,4 +1,11 @@
-import { Audiobook, AudiobookWithImages, UploadResponse, ApiError } from './types';
+import {
+  Audiobook,
+  AudiobookWithImages,
+  GeneratedImage,
+  GenerateImageResponse,
+  UploadResponse,
+  ApiError,
+} from './types';
 
 const API_BASE_URL = process.env.NEXT_PUBLIC_API_URL || 'http://localhost:8000';
 
@@ -35,8 +42,13 @@ class ApiService {
     return this.handleResponse<AudiobookWithImages>(response);
   }
 
-  async listAudiobooks(): Promise<Audiobook[]> {
-    const response = await fetch(`${this.baseUrl}/audiobooks/`);
+  async listAudiobooks(limit?: number, cursor?: number): Promise<Audiobook[]> {
+    const params = new URLSearchParams();
+    if (limit !== undefined) params.append('limit', limit.toString());
+    if (cursor !== undefined) params.append('cursor', cursor.toString());
+
+    const query = params.toString();
+    const response = await fetch(`${this.baseUrl}/audiobooks/${query ? `?${query}` : ''}`);
     return this.handleResponse<Audiobook[]>(response);
   }
 
@@ -51,11 +63,16 @@ class ApiService {
     }
   }
 
+  async getImages(audiobookId: number): Promise<GeneratedImage[]> {
+    const response = await fetch(`${this.baseUrl}/audiobooks/${audiobookId}/images`);
+    return this.handleResponse<GeneratedImage[]>(response);
+  }
+
   getImageUrl(audiobookId: number, filename: string): string {
     return `${this.baseUrl}/audiobooks/${audiobookId}/images/${filename}`;
   }
 
-  async generateImage(audiobookId: number, timestamp: number): Promise<any> {
+  async generateImage(audiobookId: number, timestamp: number): Promise<GenerateImageResponse> {
     const formData = new FormData();
     formData.append('timestamp', timestamp.toString());
 
@@ -64,7 +81,7 @@ class ApiService {
       body: formData,
     });
 
-    return this.handleResponse<any>(response);
+    return this.handleResponse<GenerateImageResponse>(response);
   }
 }
 
@@ -8,14 +8,18 @@ export interface Audiobook {
   file_path: string;
 }
 
+export type ImageStatus = 'pending' | 'completed' | 'failed';
+
 export interface GeneratedImage {
   id: number;
   audiobook_id: number;
   timestamp_seconds: number;
-  transcription: string;
-  image_prompt: string;
-  image_filename: string;
-  image_path: string;
+  status: ImageStatus;
+  error: string | null;
+  transcription: string | null;
+  image_prompt: string | null;
+  image_filename: string | null;
+  image_path: string | null;
   created_at: string;
 }
 
@@ -28,6 +32,11 @@ export interface UploadResponse {
   audiobook: Audiobook;
 }
 
+export interface GenerateImageResponse {
+  message: string;
+  image: GeneratedImage;
+}
+
 export interface ApiError {
   detail: string;
 }
\ No newline at end of file